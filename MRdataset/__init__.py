@@ -5,12 +5,20 @@ __email__ = 'raamana@gmail.com'
 
 # __version__ = '0.1.0'
 import logging
+import os
 import sys
 
 from MRdataset.config import configure_logger
 
+# worker processes started with spawn or forkserver import the package again.
+#   They inherit the environment of the main process, so only the process
+#   which imported the package first overwrites the log files, and the others
+#   append to them. The workers send their records to the main process
+#   anyway, see utils.process_map_unordered
+_main_pid = os.environ.setdefault('MRDATASET_MAIN_PID', str(os.getpid()))
 logger = logging.getLogger(__name__)
-logger = configure_logger(logger, output_dir=None, mode='w')
+logger = configure_logger(logger, output_dir=None,
+                          mode='w' if _main_pid == str(os.getpid()) else 'a')
 
 from MRdataset.common import import_dataset, load_mr_dataset, save_mr_dataset
 from MRdataset.config import MRDS_EXT, DatasetEmptyException
@@ -1,3 +1,4 @@
+import sys
 from abc import ABC, abstractmethod
 from itertools import product
 from pathlib import Path
@@ -90,8 +91,8 @@ class BaseDataset(ABC):
     # self._seq_ids : set
     #     List of unique sequence IDs in the dataset.
     # self._seqs_map : dict
-    #     Dictionary mapping sequence IDs to corresponding
-    #     (subject_id, session_id, run_id) tuples
+    #     Dictionary mapping sequence IDs to a list of corresponding
+    #     (subject_id, session_id, run_id) tuples, in the order of insertion
     # self._sess_map : dict
     #     Dictionary mapping session IDs to corresponding sequence IDs
     # self._tree_map : dict
@@ -168,7 +169,7 @@ class BaseDataset(ABC):
         if seq_id not in self._seqs_map.keys():
             return []
 
-        # seqs map is a set of tuples (subj, sess, run)
+        # seqs map has a list of (subj, sess, run) tuples for each sequence
         tuples = self._seqs_map[seq_id]
         subj_ids = set([t[0] for t in tuples])
 
@@ -225,17 +226,20 @@ class BaseDataset(ABC):
         seq_info : protocol.BaseSequence
             Instance of the sequence
         """
-        if subject_id not in self._tree_map:
-            self._tree_map[subject_id] = dict()
-
-        if session_id not in self._tree_map[subject_id]:
-            self._tree_map[subject_id][session_id] = dict()
-
-        if seq_id not in self._tree_map[subject_id][session_id]:
-            self._tree_map[subject_id][session_id][seq_id] = dict()
-
-        if run_id not in self._tree_map[subject_id][session_id][seq_id]:
-            self._tree_map[subject_id][session_id][seq_id][run_id] = seq_info
+        # a single lookup per level. Plain dicts are kept (instead of nested
+        #   defaultdicts), as they can be pickled, and a lookup of a missing
+        #   subject doesn't create empty nodes
+        runs = self._tree_map.setdefault(subject_id, {}).setdefault(
+            session_id, {}).setdefault(seq_id, {})
+        runs.setdefault(run_id, seq_info)
+
+    def __setstate__(self, state):
+        """restores a pickled dataset"""
+        self.__dict__.update(state)
+        # datasets saved by older versions store the runs of each sequence
+        #   in a set, convert them to lists to allow adding more runs
+        self._seqs_map = {seq_id: list(runs)
+                          for seq_id, runs in self._seqs_map.items()}
 
     def __str__(self):
         """readable summary"""
@@ -268,11 +272,11 @@ class BaseDataset(ABC):
         if self.format != other.format:
             raise ValueError('Both must be of the same format')
 
-        for seq_id in other.get_sequence_ids():
+        self.add_many(
+            (subj_id, sess_id, seq_id, run_id, seq)
+            for seq_id in other.get_sequence_ids()
             for subj_id, sess_id, run_id, seq in other.traverse_horizontal(
-                    seq_id):
-                self.add(subject_id=subj_id, session_id=sess_id,
-                         seq_id=seq_id, run_id=run_id, seq=seq)
+                seq_id))
 
     def merge(self, other):
         """
@@ -312,27 +316,56 @@ class BaseDataset(ABC):
             Instance of the sequence
         """
 
-        if not isinstance(seq, BaseSequence):
-            raise TypeError(f'Expected BaseSequence but got {type(seq)}')
+        self.add_many([(subject_id, session_id, seq_id, run_id, seq)])
+
+    def add_many(self, records):
+        """
+        Adds several sequences to the dataset at once. The new runs are
+        first collected and validated from all the records, and the indices
+        are then updated in bulk, instead of one record at a time. If any
+        record is invalid, the dataset is left unchanged.
 
-        if (subject_id, session_id, seq_id, run_id) not in self._flat_map:
-            self._flat_map[(subject_id, session_id, seq_id, run_id)] = seq
+        Parameters
+        ----------
+        records : Iterable[tuple]
+            Tuples of (subject_id, session_id, seq_id, run_id, seq), in the
+            same order as the arguments of add()
+        """
+        # nothing is added to the maps until every record has been checked,
+        #   so that the flat map and the indices never go out of sync
+        new_runs = {}
+        for record in records:
+            seq = record[4]
+            if not isinstance(seq, BaseSequence):
+                raise TypeError(f'Expected BaseSequence but got {type(seq)}')
+
+            # the same IDs are repeated across many keys and index entries,
+            #   so keep a single copy of each string
+            key = tuple(sys.intern(i) if type(i) is str else i
+                        for i in record[:4])
+
+            # only a run which wasn't added before needs to be indexed, and
+            #   the first sequence wins for a run repeated within the batch
+            if key not in self._flat_map:
+                new_runs.setdefault(key, seq)
+
+        self._flat_map.update(new_runs)
+        for (subject_id, session_id, seq_id, run_id), seq in new_runs.items():
             self._tree_add_node(subject_id=subject_id, session_id=session_id,
                                 seq_id=seq_id, run_id=run_id, seq_info=seq)
 
-            # map a sequence id to a specific runs with data for it
-            if seq_id not in self._seqs_map:
-                self._seqs_map[seq_id] = set()
-            self._seqs_map[seq_id].add((subject_id, session_id, run_id))
+            # map a sequence id to a specific runs with data for it. The
+            #   check on flat map above already rules out duplicates, so a
+            #   list is enough, and keeps the order of insertion
+            self._seqs_map.setdefault(seq_id, []).append(
+                (subject_id, session_id, run_id))
 
             # maintaining a different cross-mappings for insight/debugging
-            if session_id not in self._sess_map:
-                self._sess_map[session_id] = set()
-            self._sess_map[session_id].add(seq_id)
+            self._sess_map.setdefault(session_id, set()).add(seq_id)
 
-            # maintaining ID lists for easy reference
-            self._subj_ids.add(subject_id)
-            self._seq_ids.add(seq_id)
+        # maintaining ID lists for easy reference
+        self._subj_ids.update(key[0] for key in new_runs)
+        self._seq_ids.update(key[2] for key in new_runs)
 
     def get(self, subject_id, session_id, seq_id, run_id, default=None):
         """
@@ -357,8 +390,9 @@ class BaseDataset(ABC):
         default : Any
             Default value to return if the sequence is not found
         """
+        # a single lookup in the flat map, instead of walking the tree
         try:
-            return self._tree_map[subject_id][session_id][seq_id][run_id]
+            return self._flat_map[(subject_id, session_id, seq_id, run_id)]
         except KeyError:
             logger.info('Unable to find '
                         f'{subject_id}/{session_id}/{seq_id}/{run_id}')
@@ -407,12 +441,30 @@ class BaseDataset(ABC):
             instance
         """
 
-        for subj in self._subj_ids:
-            for sess in self._tree_map[subj]:
-                if seq_id in self._tree_map[subj][sess]:
-                    for run in self._tree_map[subj][sess][seq_id]:
-                        yield (subj, sess, run,
-                               self._tree_map[subj][sess][seq_id][run])
+        # seqs map already has the runs acquired with this sequence, so there
+        #   is no need to walk through all the subjects and sessions
+        for subj, sess, run in self._seqs_map.get(seq_id, ()):
+            yield subj, sess, run, self._flat_map[(subj, sess, seq_id, run)]
+
+    def _sessions_with_sequences(self, *seq_ids):
+        """
+        Returns the (subject_id, session_id) pairs which have runs for all the
+        given sequences
+
+        Parameters
+        ----------
+        seq_ids : list
+            Sequence IDs to look for
+        """
+        sessions = None
+        for seq_id in seq_ids:
+            seq_sessions = {(subj, sess) for subj, sess, _ in
+                            self._seqs_map.get(seq_id, ())}
+            if sessions is None:
+                sessions = seq_sessions
+            else:
+                sessions &= seq_sessions
+        return sessions or set()
 
     def traverse_vertical2(self, seq_id1, seq_id2):
         """
@@ -435,22 +487,17 @@ class BaseDataset(ABC):
         """
 
         count = 0
-        for subj in self._subj_ids:
-            for sess in self._tree_map[subj]:
-                # checking for subset relationship
-                if {seq_id1, seq_id2} <= self._tree_map[subj][sess].keys():
-                    # two sequences may not have a common run ID
-                    #   they might have multiple runs, with different number
-                    #   of runs
-                    #   so getting all of their linked combinations
-                    linked_runs = self._link_runs_across_sequences(
-                        self._tree_map[subj][sess][seq_id1],
-                        self._tree_map[subj][sess][seq_id2])
-                    for run1, run2 in linked_runs:
-                        count = count + 1
-                        yield (subj, sess, run1, run2,
-                               self._tree_map[subj][sess][seq_id1][run1],
-                               self._tree_map[subj][sess][seq_id2][run2])
+        # only the sessions which have both the sequences
+        for subj, sess in self._sessions_with_sequences(seq_id1, seq_id2):
+            runs1 = self._tree_map[subj][sess][seq_id1]
+            runs2 = self._tree_map[subj][sess][seq_id2]
+            # two sequences may not have a common run ID
+            #   they might have multiple runs, with different number
+            #   of runs
+            #   so getting all of their linked combinations
+            for run1, run2 in self._link_runs_across_sequences(runs1, runs2):
+                count = count + 1
+                yield subj, sess, run1, run2, runs1[run1], runs2[run2]
 
         if count < 1:
             logger.info('There were no sessions/runs in these sequences!')
@@ -474,24 +521,20 @@ class BaseDataset(ABC):
         """
 
         count = 0
-        for subj in self._subj_ids:
-            for sess in self._tree_map[subj]:
-                # if all seq IDs exist in session
-                #   checking for subset relationship:
-                if set(seq_ids) <= self._tree_map[subj][sess].keys():
-                    seqs = [self._tree_map[subj][sess][sq] for sq in seq_ids]
+        # only the sessions in which all seq IDs exist
+        for subj, sess in self._sessions_with_sequences(*seq_ids):
+            seqs = [self._tree_map[subj][sess][sq] for sq in seq_ids]
 
-                    # two sequences may not have a common run ID
-                    #   they might have multiple runs, with different number
-                    #   of runs
-                    #   so getting all of their linked combinations
-                    runs = self._first_run_from_sequences(seqs)
+            # two sequences may not have a common run ID
+            #   they might have multiple runs, with different number
+            #   of runs
+            #   so getting all of their linked combinations
+            runs = self._first_run_from_sequences(seqs)
 
-                    out_seqs = [self._tree_map[subj][sess][seq_id][run_id]
-                                for seq_id, run_id in zip(seq_ids, runs)]
+            out_seqs = [seq[run_id] for seq, run_id in zip(seqs, runs)]
 
-                    count = count + 1
-                    yield subj, sess, runs, out_seqs
+            count = count + 1
+            yield subj, sess, runs, out_seqs
 
         if count < 1:
             logger.warning(
@@ -514,24 +557,6 @@ class BaseDataset(ABC):
 
         return run_list
 
-    # @staticmethod
-    # def _run_combinations_across_sequences(seq_list):
-    #     """returns a combinatorial pairs of runs from sequence list"""
-    #
-    #     run_lists = [list(seq.keys()) for seq in seq_list if
-    #                  len(seq.keys()) >= 1]
-    #
-    #     for ii in range(len(run_lists)):
-    #         # remaining lists
-    #         for jj in range(ii + 1, len(run_lists)):
-    #             # for each element from first list
-    #             for kk in range(len(run_lists[ii])):
-    #                 # all elements from the other lists
-    #                 for qq in range(len(run_lists[jj])):
-    #                     yield run_lists[ii][kk], run_lists[jj][qq]
-    #
-    #     return run_lists
-
     @staticmethod
     def _link_runs_across_sequences(seq_dict1, seq_dict2):
         """returns a combinatorial combination of runs from two sequences"""
@@ -544,8 +569,7 @@ class BaseDataset(ABC):
             logger.warning(f'{seq_dict2} has no runs!')
 
         # combinatorial
-        for run_one, run_two in product(seq_dict1.keys(), seq_dict2.keys()):
-            yield run_one, run_two
+        yield from product(seq_dict1.keys(), seq_dict2.keys())
 
     def __eq__(self, other):
         """equality check"""
@@ -1,14 +1,20 @@
+import os
+import re
 from abc import ABC
 from pathlib import Path
-from re import search
 
 from MRdataset import logger
 from MRdataset.base import BaseDataset
-from MRdataset.config import VALID_BIDS_DATATYPES, SUPPORTED_BIDS_DATATYPES
+from MRdataset.config import VALID_BIDS_DATATYPES, \
+    SUPPORTED_BIDS_DATATYPES, folder_cache_fpath
 from MRdataset.dicom_utils import is_bids_file
-from MRdataset.utils import folders_with_min_files, valid_dirs, read_json
+from MRdataset.utils import folders_with_min_files, valid_dirs, read_json, \
+    files_in_folder, cached_folders_with_min_files, map_dataset_folders
 from protocol import BidsImagingSequence
 
+# compiled once, as the run id is extracted for every sidecar
+RUN_ID_PATTERN = re.compile(r'run-[^_]+')
+
 
 class BidsDataset(BaseDataset, ABC):
     """
@@ -29,6 +35,22 @@ class BidsDataset(BaseDataset, ABC):
         Whether to print verbose output on console.
     ds_format : str
         The format of the dataset. One of ['dicom', 'bids'].
+    n_jobs : int
+        Number of worker processes used to read the folders in parallel.
+        Default is 1, i.e. folders are read sequentially. Use -1 to use
+        all the available CPUs.
+    n_threads : int
+        Number of threads used to walk the folder tree. Listing folders is
+        dominated by the latency of the filesystem (e.g. on network
+        storage), so listing several of them concurrently helps despite the
+        GIL. Default is 1. Use -1 to use as many threads as the available
+        CPUs.
+    cache_folders : bool
+        Whether to save the list of folders found in the data_source to
+        the output_dir, and re-use it in the next run instead of walking
+        the whole tree again. The list is refreshed only if the contents of
+        the data_source root folders change, so use it for datasets which
+        are not modified in place. Default is False.
     """
 
     def __init__(self, data_source, pattern="*.json",
@@ -37,6 +59,9 @@ class BidsDataset(BaseDataset, ABC):
                  verbose=False,
                  output_dir=None,
                  min_count=1,
+                 n_jobs=1,
+                 n_threads=1,
+                 cache_folders=False,
                  **kwargs):
 
         super().__init__(data_source=data_source, name=name, ds_format='bids')
@@ -46,6 +71,15 @@ class BidsDataset(BaseDataset, ABC):
         self.verbose = verbose
         self.config_dict = None
         self.min_count = min_count
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        self.n_jobs = n_jobs
+        if n_threads is None or n_threads < 1:
+            n_threads = os.cpu_count() or 1
+        self.n_threads = n_threads
+        self.cache_folders = cache_folders
+        # whether the folders being read were listed from the cache
+        self._folders_from_cache = False
 
         try:
             self.output_dir = Path(output_dir)
@@ -54,6 +88,8 @@ class BidsDataset(BaseDataset, ABC):
             raise exc
 
         self.output_dir.mkdir(exist_ok=True, parents=True)
+        self._folder_cache_path = folder_cache_fpath(self.output_dir,
+                                                     self.name)
 
         # read the config file
         try:
@@ -74,23 +110,77 @@ class BidsDataset(BaseDataset, ABC):
         """
 
         for directory in self.data_source:
-            # find all sub-folders with at least min_count files matching the
-            # pattern
-            subfolders = folders_with_min_files(directory, self.pattern,
-                                                self.min_count)
-            for folder in subfolders:
-                # process each folder
-                sequences = self._process(folder)
-                for seq in sequences:
-                    self.add(subject_id=seq.subject_id,
-                             session_id=seq.session_id,
-                             run_id=seq.run_id,
-                             seq_id=seq.name, seq=seq)
+            try:
+                self._load_directory(directory)
+            except FileNotFoundError as exc:
+                if not self._folders_from_cache:
+                    raise
+                # a folder from the cache was removed, see _read_folder.
+                #   The sequences already added from this directory are
+                #   skipped by add_many when the folders are read again.
+                logger.warning(f'The cached list of folders in {directory} '
+                               f'is out of date. Got {exc}. Listing the '
+                               f'folders again.')
+                self._load_directory(directory, refresh=True)
+
+    def _load_directory(self, directory, refresh=False):
+        """
+        Finds all the sub-folders with at least min_count files matching the
+        pattern in the directory, and adds the sequences read from them to
+        the dataset.
+
+        Parameters
+        ----------
+        directory : Path
+            One of the folders in data_source
+        refresh : bool
+            Whether to list the folders again, instead of using the cached
+            list of folders. Only used if cache_folders is True.
+        """
+        if self.cache_folders:
+            subfolders = cached_folders_with_min_files(
+                directory, self._folder_cache_path, self.pattern,
+                self.min_count, max_workers=self.n_threads, refresh=refresh)
+        else:
+            subfolders = folders_with_min_files(
+                directory, self.pattern, self.min_count,
+                max_workers=self.n_threads)
+        # a folder missing from the cached list means that the list is out
+        #   of date, so _read_folder lets load() list the folders again
+        self._folders_from_cache = self.cache_folders and not refresh
+        if self.n_jobs > 1:
+            # folders are independent, so they are processed in parallel
+            processed = map_dataset_folders(self, '_read_folder', subfolders,
+                                            max_workers=self.n_jobs)
+        else:
+            processed = map(self._read_folder, subfolders)
+        for sequences in processed:
+            self.add_many((seq.subject_id, seq.session_id, seq.name,
+                           seq.run_id, seq) for seq in sequences)
+
+    def _read_folder(self, folder):
+        """
+        Reads the sequences from a folder, see _process. Returns an empty
+        list if the folder can't be read, e.g. if it was removed after it
+        was listed, so that a single folder doesn't stop the rest of the
+        dataset from loading. If a folder from the cached list of folders
+        doesn't exist anymore, the FileNotFoundError is raised instead, see
+        load.
+        """
+        try:
+            return self._process(folder)
+        except OSError as exc:
+            if self._folders_from_cache and isinstance(exc, FileNotFoundError):
+                raise
+            logger.error(f'Unable to process {folder}. Got {exc}')
+            return []
 
     def _filter_json_files(self, folder):
         """Filters the JSON files from the folder."""
-        json_files = sorted(folder.glob(self.pattern))
-        valid_bids_files = list(filter(is_bids_file, json_files))
+        json_files = files_in_folder(folder, self.pattern)
+        # the paths are filtered as strings, only the valid ones are needed
+        #   as Path objects
+        valid_bids_files = [Path(f) for f in json_files if is_bids_file(f)]
         if not valid_bids_files:
             logger.info(f'No valid BIDS files found in {folder}')
             return []
@@ -100,26 +190,31 @@ class BidsDataset(BaseDataset, ABC):
         """Processes the folder and returns a list of sequences."""
         json_files = self._filter_json_files(folder)
         sequences = []
+        if not json_files:
+            return sequences
+
+        # all the files are in the same folder, so the datatype, subject and
+        #   session derived from the folder are the same for all of them
+        name = folder.name
+        if name not in VALID_BIDS_DATATYPES:
+            logger.error(f'Invalid datatype found: {name}. Skipping it')
+            return sequences
+
+        subject_id = folder.parents[1].name
+        session_id = folder.parent.name
+        if 'sub' in session_id:
+            logger.info(f"Sessions don't exist: {session_id}.")
+            subject_id = session_id
+            session_id = 'ses-01'
+
         last_id = 0
-        for i, file in enumerate(json_files):
+        for file in json_files:
             try:
                 seq = BidsImagingSequence(bidsfile=file, path=folder)
             except (ValueError, IOError) as exc:
                 logger.error(f'Error processing {file}. Skipping it. Got {exc}')
                 continue
 
-            name = file.parent.name
-            if name not in VALID_BIDS_DATATYPES:
-                logger.error(f'Invalid datatype found: {name}. Skipping it')
-                return sequences
-
-            subject_id = file.parents[2].name
-            session_id = file.parents[1].name
-            if 'sub' in session_id:
-                logger.info(f"Sessions don't exist: {session_id}.")
-                subject_id = session_id
-                session_id = 'ses-01'
-
             # None of the datasets we processed (over 20) had run information,
             # even though BIDS allows it. So we just use run-0x for all of them.
             run_id, last_id = self.get_run_id(file, last_id)
@@ -144,10 +239,8 @@ class BidsDataset(BaseDataset, ABC):
         Use regex to extract run id from filename.
         Example filename : sub-01_ses-imagery01_task-imagery_run-01_bold.json
         """
-        # Regular expression pattern
-        pattern = r'run-[^_]+'
         # Extracting substring using regex
-        match = search(pattern, str(filename))
+        match = RUN_ID_PATTERN.search(str(filename))
 
         if match:
             run_id = match.group(0)
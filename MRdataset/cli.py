@@ -33,6 +33,10 @@ def get_parser():
                           help='flag dataset as a partial dataset')
     optional.add_argument('-v', '--verbose', action='store_true',
                           help='allow verbose output on console')
+    optional.add_argument('-j', '--n-jobs', type=int, default=1,
+                          help='number of processes used to read the '
+                               'dataset in parallel. Use -1 to use all '
+                               'available CPUs. Default is 1.')
     return parser
 
 
@@ -88,6 +92,9 @@ def cli():
         flag dataset as a partial dataset. The flag is useful while reading a
         dataset in chunks e.g. when the dataset is too large to fit in memory.
         If the dataset is complete, the flag should not be set.
+    -j, --n-jobs : int
+        number of processes used to read the dataset in parallel. Use -1 to
+        use all available CPUs. Default is 1.
 
     Examples
     --------
@@ -103,7 +110,8 @@ def cli():
                              verbose=args.verbose,
                              is_complete=not args.is_partial,
                              config_path=args.config,
-                             output_dir=args.output_dir)
+                             output_dir=args.output_dir,
+                             n_jobs=args.n_jobs)
     save_mr_dataset(f"{args.output_dir}/{dataset.name}.mrds.pkl", dataset)
     return dataset
 
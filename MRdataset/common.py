@@ -5,7 +5,7 @@ from typing import Union, List
 from MRdataset import logger
 from MRdataset.base import BaseDataset
 from MRdataset.bids import BidsDataset
-from MRdataset.config import VALID_DATASET_FORMATS
+from MRdataset.config import VALID_DATASET_FORMATS, MRDS_BUFFER_SIZE
 from MRdataset.dicom import DicomDataset
 from MRdataset.utils import random_name, check_mrds_extension
 
@@ -166,7 +166,8 @@ def load_mr_dataset(filepath: Union[str, Path]) -> 'BaseDataset':
     if not filepath.is_file():
         raise FileNotFoundError(f'Invalid filepath {filepath}')
 
-    with open(filepath, 'rb') as f:
+    # a larger buffer saves many small reads for big datasets
+    with open(filepath, 'rb', buffering=MRDS_BUFFER_SIZE) as f:
         fetched = pickle.load(f)
         if isinstance(fetched, BaseDataset):
             # If object is found, return object
@@ -218,6 +219,7 @@ def save_mr_dataset(filepath: Union[str, Path],
 
     if isinstance(mrds_obj, DicomDataset):
         mrds_obj.save_process_log(parent_folder)
-    with open(filepath, 'wb') as f:
-        # save dict of the object as pickle
-        pickle.dump(mrds_obj, f)
+    with open(filepath, 'wb', buffering=MRDS_BUFFER_SIZE) as f:
+        # save dict of the object as pickle. The highest protocol is faster
+        #   and more compact than the default
+        pickle.dump(mrds_obj, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -8,6 +8,8 @@ from protocol import ACRONYMS_IMAGING_PARAMETERS
 VALID_PARAMETERS = sorted(list(ACRONYMS_IMAGING_PARAMETERS.keys()))
 
 MRDS_EXT = '.mrds.pkl'
+#: Buffer size (in bytes) for reading/writing the pickled datasets
+MRDS_BUFFER_SIZE = 1 << 20
 VALID_DATASET_FORMATS = [
     'dicom',
     'bids',
@@ -119,3 +121,10 @@ def previous_log_fpath(folder, name):
     Return the path to the previous run log file
     """
     return Path(folder) / f'{name}_previous_run_log.json'
+
+
+def folder_cache_fpath(folder, name):
+    """
+    Return the path to the file caching the folders found in the dataset
+    """
+    return Path(folder) / f'{name}_folders_cache.json'
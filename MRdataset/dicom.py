@@ -1,5 +1,8 @@
 import json
+import os
 from abc import ABC
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 from pathlib import Path
 from typing import Tuple, List
@@ -10,10 +13,13 @@ from pydicom.errors import InvalidDicomError
 
 from MRdataset import logger
 from MRdataset.base import BaseDataset
-from MRdataset.config import previous_log_fpath
+from MRdataset.config import previous_log_fpath, folder_cache_fpath
 from MRdataset.dicom_utils import (is_valid_inclusion,
-                                   is_dicom_file)
-from MRdataset.utils import (folders_with_min_files, read_json, valid_dirs)
+                                   is_dicom_file, slice_fingerprint,
+                                   SCREENING_TAGS)
+from MRdataset.utils import (folders_with_min_files, read_json, valid_dirs,
+                             files_in_folder, cached_folders_with_min_files,
+                             map_dataset_folders)
 
 
 # A dataset is a collection of subjects
@@ -30,6 +36,24 @@ from MRdataset.utils import (folders_with_min_files, read_json, valid_dirs)
 # https://github.com/icometrix/dicom2nifti/blob/ecbf43a66174375285fae485439ea8dd940005ba/dicom2nifti/convert_dir.py#L68 # noqa
 #
 
+# Compact record returned by the worker processes for each folder
+FolderResult = namedtuple('FolderResult', ['folder', 'seq', 'process_whole'])
+
+
+def _safe_dcmread(dcm_path, specific_tags=None):
+    """Reads the dicom header, returns None if it is not a valid dicom"""
+    try:
+        return dcmread(dcm_path, stop_before_pixels=True,
+                       specific_tags=specific_tags)
+    except (InvalidDicomError, PermissionError, FileNotFoundError) as e:
+        logger.info(f'Invalid DICOM file at {dcm_path}. Got {e}')
+        return None
+
+
+def _screen_dcmread(dcm_path):
+    """Reads only the elements needed to screen a slice, see SCREENING_TAGS"""
+    return _safe_dcmread(dcm_path, specific_tags=SCREENING_TAGS)
+
 
 class DicomDataset(BaseDataset, ABC):
     """
@@ -50,6 +74,27 @@ class DicomDataset(BaseDataset, ABC):
         Whether to print verbose output on console. Default is False.
     ds_format : str
         The format of the dataset. Default is 'dicom'. Choose one of ['dicom']
+    n_jobs : int
+        Number of worker processes used to read the folders in parallel.
+        Default is 1, i.e. folders are read sequentially. Use -1 to use
+        all the available CPUs.
+    n_threads : int
+        Number of threads used to walk the folder tree, and to read the
+        slices within each folder. Listing folders and reading a slice are
+        dominated by the latency of the filesystem (e.g. on network
+        storage), so doing several of them concurrently helps despite the
+        GIL. Default is 1. Use -1 to use as many threads as the available
+        CPUs.
+    fast_scan : bool
+        Whether to read only a sample of the slices in each folder, i.e. the
+        first slice and a few slices picked at regular intervals, instead of
+        all the slices. Default is False.
+    cache_folders : bool
+        Whether to save the list of folders found in the data_source to
+        the output_dir, and re-use it in the next run instead of walking
+        the whole tree again. The list is refreshed only if the contents of
+        the data_source root folders change, so use it for datasets which
+        are not modified in place. Default is False.
     """
 
     def __init__(self,
@@ -60,6 +105,10 @@ class DicomDataset(BaseDataset, ABC):
                  verbose=False,
                  output_dir=None,
                  min_count=1,
+                 n_jobs=1,
+                 n_threads=1,
+                 fast_scan=False,
+                 cache_folders=False,
                  **kwargs):
         """constructor"""
 
@@ -70,6 +119,16 @@ class DicomDataset(BaseDataset, ABC):
         # TODO: Add option to change min_count passing it as an argument
         self.min_count = min_count  # min slice count to be considered a volume
         self.verbose = verbose
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        self.n_jobs = n_jobs
+        if n_threads is None or n_threads < 1:
+            n_threads = os.cpu_count() or 1
+        self.n_threads = n_threads
+        self.fast_scan = fast_scan
+        self.cache_folders = cache_folders
+        # whether the folders being read were listed from the cache
+        self._folders_from_cache = False
         self.config_path = config_path
         self.config_dict = None
 
@@ -109,8 +168,8 @@ class DicomDataset(BaseDataset, ABC):
             self._process_whole_folder = read_json(self._previous_log_path)
         else:
             self._process_whole_folder = dict()
-
-        # print('')
+        self._folder_cache_path = folder_cache_fpath(self.output_dir,
+                                                     self.name)
 
     def merge(self, other):
         """Merges two dicom datasets"""
@@ -133,25 +192,140 @@ class DicomDataset(BaseDataset, ABC):
         #     return
 
         for directory in self.data_source:
-            # find all the sub-folders with at least min_count files
-            sub_folders = folders_with_min_files(directory, self.pattern,
-                                                 self.min_count)
-            for folder in sub_folders:
-                # process each folder
-                seq = self._process_slice_collection(folder)
-                if seq is None:
-                    self._process_whole_folder[str(folder)] = False
-                    logger.info(f'Unable to process {folder}. Skipping it.')
-                else:
-                    self.add(subject_id=seq.subject_id,
-                             session_id=seq.session_id,
-                             run_id=seq.run_id, seq_id=seq.name, seq=seq)
+            try:
+                self._load_directory(directory)
+            except FileNotFoundError as exc:
+                if not self._folders_from_cache:
+                    raise
+                # a folder from the cache was removed, see _read_folder.
+                #   Nothing was added from this directory, as add_many
+                #   doesn't add any of the records if one of them fails.
+                logger.warning(f'The cached list of folders in {directory} '
+                               f'is out of date. Got {exc}. Listing the '
+                               f'folders again.')
+                self._load_directory(directory, refresh=True)
 
         # saving a copy for quicker reload
         # self.save()
         # dump the log to json file
         # self.save_process_log()
 
+    def _load_directory(self, directory, refresh=False):
+        """
+        Finds all the sub-folders with at least min_count files in the
+        directory, and adds the sequences read from them to the dataset.
+
+        Parameters
+        ----------
+        directory : Path
+            One of the folders in data_source
+        refresh : bool
+            Whether to list the folders again, instead of using the cached
+            list of folders. Only used if cache_folders is True.
+        """
+        if self.cache_folders:
+            sub_folders = cached_folders_with_min_files(
+                directory, self._folder_cache_path, self.pattern,
+                self.min_count, max_workers=self.n_threads, refresh=refresh)
+        else:
+            sub_folders = folders_with_min_files(
+                directory, self.pattern, self.min_count,
+                max_workers=self.n_threads)
+        # a folder missing from the cached list means that the list is out
+        #   of date, so _read_folder lets load() list the folders again
+        self._folders_from_cache = self.cache_folders and not refresh
+        processed = self._process_folders(sub_folders)
+        self.add_many(self._sequence_records(processed))
+
+    def _sequence_records(self, processed):
+        """
+        Yields the records to be added to the dataset from the processed
+        folders, as (subject_id, session_id, seq_id, run_id, seq) tuples.
+        Folders which couldn't be processed are logged and skipped.
+        """
+        for folder, seq in processed:
+            if seq is None:
+                self._process_whole_folder[str(folder)] = False
+                logger.info(f'Unable to process {folder}. Skipping it.')
+            else:
+                yield (seq.subject_id, seq.session_id, seq.name,
+                       seq.run_id, seq)
+
+    def _process_folders(self, folders):
+        """
+        Processes the folders one after the other, or in a pool of worker
+        processes if n_jobs > 1. Both yield the same results, in any order.
+
+        Parameters
+        ----------
+        folders : Iterable[Path]
+            The folders containing the dicom slices
+
+        Yields
+        ------
+        Tuple[Path, DicomImagingSequence]
+            The folder and the sequence read from it, or None if the folder
+            could not be processed
+        """
+        if self.n_jobs > 1:
+            return self._process_folders_parallel(folders)
+        return ((folder, self._read_folder(folder)) for folder in folders)
+
+    def _read_folder(self, folder):
+        """
+        Reads the sequence from a folder, see _process_slice_collection.
+        Returns None if the folder can't be read, e.g. if it was removed
+        after it was listed, so that a single folder doesn't stop the rest
+        of the dataset from loading. If a folder from the cached list of
+        folders doesn't exist anymore, the FileNotFoundError is raised
+        instead, see load.
+        """
+        try:
+            return self._process_slice_collection(folder)
+        except (OSError, InvalidDicomError) as exc:
+            if self._folders_from_cache and isinstance(exc, FileNotFoundError):
+                raise
+            logger.error(f'Unable to process {folder}. Got {exc}')
+            return None
+
+    def _process_folders_parallel(self, folders):
+        """
+        Processes the folders in a pool of worker processes, as folders are
+        independent of each other. See map_dataset_folders.
+
+        Parameters
+        ----------
+        folders : Iterable[Path]
+            The folders containing the dicom slices
+
+        Yields
+        ------
+        Tuple[Path, DicomImagingSequence]
+            The folder and the sequence read from it, or None if the folder
+            could not be processed
+        """
+        results = map_dataset_folders(self, '_read_folder_result', folders,
+                                      max_workers=self.n_jobs)
+        for result in results:
+            yield self._collect_processed(result)
+
+    def _read_folder_result(self, folder):
+        """
+        Reads a folder in a worker process. Returns a FolderResult with the
+        sequence and the processed status of the folder, so that the parent
+        process can update its own state.
+        """
+        seq = self._read_folder(folder)
+        if seq is None:
+            return FolderResult(folder, None, False)
+        process_whole = self._process_whole_folder.get(str(folder), True)
+        return FolderResult(folder, seq, process_whole)
+
+    def _collect_processed(self, result):
+        """Updates the folder status from the result of a worker process"""
+        self._process_whole_folder[str(result.folder)] = result.process_whole
+        return result.folder, result.seq
+
     def save_process_log(self, output_dir=None):
         """
         Saves the log file to the output directory. This log file contains
@@ -186,21 +360,82 @@ class DicomDataset(BaseDataset, ABC):
         folder : Path
             The path to the folder containing the dicom slices
         """
-        dcm_files = sorted(folder.glob(self.pattern))
+        dcm_files = files_in_folder(folder, self.pattern)
         # check if we have processed this folder before
         process_whole = self._process_whole_folder.get(str(folder), True)
-        # filter dicom files from the folder
-        valid_dicom_files = filter(is_dicom_file, dcm_files)
-        # if valid_dicom_files is empty, we cannot process this folder
-        if not valid_dicom_files:
-            return []
 
         if process_whole:
-            return valid_dicom_files
+            # no need to check the DICM prefix of each file here, dcmread
+            #   rejects non-dicom files anyway, while reading them. This
+            #   avoids opening every file twice.
+            if self.fast_scan:
+                return self._sample_dcm_files(dcm_files)
+            return dcm_files
         else:
-            # just return a single file
+            # just return a few valid dicom files
             logger.info(f'Processing only one file from {folder}')
-            return islice(valid_dicom_files, 0, 3)
+            return islice(filter(is_dicom_file, dcm_files), 0, 3)
+
+    def _read_slices(self, dcm_files):
+        """
+        Reads the screening elements (see SCREENING_TAGS) of the slices, in
+        a pool of threads if n_threads is more than 1. Yields the path and
+        the partial header (or None, if it is not a valid dicom) of each
+        slice, in the same order as dcm_files.
+
+        Parameters
+        ----------
+        dcm_files : Iterable[str]
+            paths to the dicom slices
+        """
+        if self.n_threads > 1:
+            dcm_files = list(dcm_files)
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                yield from zip(dcm_files,
+                               executor.map(_screen_dcmread, dcm_files))
+        else:
+            for dcm_path in dcm_files:
+                yield dcm_path, _screen_dcmread(dcm_path)
+
+    def _is_seen_slice(self, screened, seen_fingerprints):
+        """
+        Checks if the partial header of a slice has the same fingerprint as
+        one of the slices processed so far, and is a valid inclusion. Most
+        slices of a volume match a previous slice in the session info and
+        the echo parameters (e.g. one slice per echo), and can be skipped
+        without reading their whole header.
+
+        Parameters
+        ----------
+        screened : pydicom.Dataset
+            partial header of the slice, read with SCREENING_TAGS
+        seen_fingerprints : set
+            fingerprints of the slices processed so far
+        """
+        if slice_fingerprint(screened) not in seen_fingerprints:
+            return False
+        return is_valid_inclusion(screened, self.include_phantom,
+                                  self.include_moco, self.include_sbref,
+                                  self.include_derived,
+                                  suppress_warnings=True)
+
+    @staticmethod
+    def _sample_dcm_files(dcm_files, num_samples=8):
+        """
+        Picks the first file, and files at regular intervals from the rest of
+        the folder. Multi-echo slices are generally interleaved, or
+        stored in blocks, so a few samples are enough to find all
+        the echoes.
+
+        Parameters
+        ----------
+        dcm_files : List[str]
+            sorted list of files in the folder
+        num_samples : int
+            approximate number of files to pick. Default is 8.
+        """
+        stride = max(1, len(dcm_files) // num_samples)
+        return dcm_files[::stride]
 
     def _set_folder_status(self, folder, divergent_slices):
         # update the folder processed status. If more than 1 divergent slice
@@ -237,23 +472,29 @@ class DicomDataset(BaseDataset, ABC):
         # collect all the slices with diverging parameters
         divergent_slices = list()
         first_slice = None
+        seen_fingerprints = set()
         localizer_flag = False
         # iterate over all the slices, check if it is a valid dicom file
-        for dcm_path in dcm_files:
-            try:
-                dicom = dcmread(dcm_path, stop_before_pixels=True)
-            except (InvalidDicomError, PermissionError) as e:
-                logger.info(f'Invalid DICOM file at {dcm_path}. Got {e}')
+        for dcm_path, screened in self._read_slices(dcm_files):
+            if (screened is None
+                    or self._is_seen_slice(screened, seen_fingerprints)):
+                continue
+
+            # the slice differs from the slices processed so far,
+            #   so we need the whole header
+            dicom = _safe_dcmread(dcm_path)
+            if dicom is None:
                 continue
 
             # skip localizer, phantom, scouts, sbref, etc
             if not is_valid_inclusion(dicom, self.include_phantom,
                                       self.include_moco, self.include_sbref,
                                       self.include_derived,
-                                      folder=dcm_path.parent,
+                                      folder=folder,
                                       suppress_warnings=localizer_flag):
                 localizer_flag = True
                 continue
+            seen_fingerprints.add(slice_fingerprint(dicom))
 
             # until the first slice is found, we cannot compare
             #   other slices with it. So, we collect the first slice
@@ -285,22 +526,7 @@ class DicomDataset(BaseDataset, ABC):
                                     ' This should rarely happen.'
                                     'This would make data reading really slow. '
                                     'Please check the dataset.')
-                flag = 0
-                for each_slice in divergent_slices:
-                    # we only compare the parameters that are subject to
-                    # variation e.g. EchoTime
-                    #   It is not recommended to compare all parameters as it
-                    #   would be very slow. Also, some parameters are e.g.
-                    #   SliceLocation would be different for each slice.
-                    #   If SliceLocation is also compared, We will end up having
-                    #   all slices in divergent_slices list.
-                    if cur_slice.compare_subset_params(each_slice):
-                        flag = 1
-                        break
-                        # If number of divergent slices is large,
-                        # this would make it faster
-
-                if flag == 0:
+                if not self._matches_any_slice(cur_slice, divergent_slices):
                     divergent_slices.append(cur_slice)
 
         self._set_folder_status(folder, divergent_slices)
@@ -319,6 +545,30 @@ class DicomDataset(BaseDataset, ABC):
             #   See: https://stackoverflow.com/questions/59458801/how-to-sort-dicom-slices-in-correct-order # noqa
         return first_slice
 
+    @staticmethod
+    def _matches_any_slice(cur_slice, slices):
+        """
+        Checks if the parameters of the slice match with any of the given
+        slices. Stops at the first match, which makes it faster if the
+        number of slices is large.
+
+        Parameters
+        ----------
+        cur_slice : DicomImagingSequence
+            slice to compare
+        slices : List[DicomImagingSequence]
+            slices collected so far
+        """
+        # we only compare the parameters that are subject to
+        # variation e.g. EchoTime
+        #   It is not recommended to compare all parameters as it
+        #   would be very slow. Also, some parameters are e.g.
+        #   SliceLocation would be different for each slice.
+        #   If SliceLocation is also compared, We will end up having
+        #   all slices in divergent_slices list.
+        return any(cur_slice.compare_subset_params(each_slice)
+                   for each_slice in slices)
+
     def _process_echo_times(self, divergent_slices: List) -> Tuple:
         """
         Finds the set of echo times and echo numbers from the list of
@@ -347,7 +597,6 @@ class DicomDataset(BaseDataset, ABC):
                     echo_dict[enum] = i_slice['EchoTime'].get_value()
             return echo_dict.values(), echo_dict.keys()
         else:
-            echo_times = set()
-            for i_slice in divergent_slices:
-                echo_times.add(i_slice['EchoTime'].get_value())
+            echo_times = {i_slice['EchoTime'].get_value()
+                          for i_slice in divergent_slices}
             return echo_times, None
@@ -1,16 +1,50 @@
 """ Utility functions for dicom files """
+import re
 import warnings
 from pathlib import Path
-from re import search
 from typing import Union
 
 import dicom2nifti
 import pydicom
+from pydicom.multival import MultiValue
+
 from MRdataset import logger
 
 with warnings.catch_warnings():
     warnings.filterwarnings('ignore')
 
+# DICOM tags read while screening every slice. Accessing the elements by
+#   their integer tags skips the keyword-to-tag conversion in pydicom.
+IMAGE_TYPE_TAG = 0x00080008
+SERIES_DESCRIPTION_TAG = 0x0008103E
+PATIENT_ID_TAG = 0x00100020
+PATIENT_SEX_TAG = 0x00100040
+PATIENT_AGE_TAG = 0x00101010
+
+# compiled once, as every sidecar of a BIDS dataset is checked against it
+BIDS_SUBJECT_PATTERN = re.compile(r'sub-[^_]+')
+
+# DICOM tags which identify the session/run of a slice, along with the
+#   parameters which may vary across slices of a volume (e.g. multi-echo).
+#   Slices with equal values for all these tags are redundant while looking
+#   for the varying parameters.
+SLICE_FINGERPRINT_TAGS = tuple(
+    pydicom.datadict.tag_for_keyword(keyword) for keyword in (
+        'PatientName', 'PatientID', 'StudyInstanceUID', 'StudyID',
+        'SeriesInstanceUID', 'SeriesNumber', 'SeriesDescription',
+        'ProtocolName', 'RepetitionTime', 'EchoTime', 'EchoNumbers',
+        'InversionTime', 'FlipAngle'))
+
+# DICOM tags needed to screen a slice, i.e. to compute its fingerprint and to
+#   check if it is a valid inclusion. Reading only these elements with
+#   dcmread(specific_tags=...) is much cheaper than parsing the whole header.
+SCREENING_TAGS = SLICE_FINGERPRINT_TAGS + (
+    IMAGE_TYPE_TAG, SERIES_DESCRIPTION_TAG, PATIENT_ID_TAG, PATIENT_SEX_TAG,
+    PATIENT_AGE_TAG) + tuple(
+    pydicom.datadict.tag_for_keyword(keyword) for keyword in (
+        'SOPClassUID', 'Modality', 'Manufacturer', 'InstanceNumber',
+        'ImagePositionPatient', 'ImageOrientationPatient', 'NumberOfFrames'))
+
 
 # logger = logging.getLogger('root')
 
@@ -26,26 +60,26 @@ def is_bids_file(filename: Union[str, Path]):
     -------
     bool : if the file is a valid BIDS file
     """
+    # convert the path to a string once, for all the checks below
+    filename = str(filename)
     # TODO: Add some criteria to skip certain files
-    if 'derivatives' in str(filename):
+    if 'derivatives' in filename:
         return False
-    if 'bidsignore' in str(filename):
+    if 'bidsignore' in filename:
         return False
-    if 'sourcedata' in str(filename):
+    if 'sourcedata' in filename:
         return False
 
     # TODO: Add support for physiological and other continuous
     #  recordings. Skip for now.
     #  See : https://bids-specification.readthedocs.io/en/stable/modality-specific-files/physiological-and-other-continuous-recordings.html # noqa
     #  Example dataset on OpenNeuro : ds002785
-    if '_physio.' in str(filename):
+    if '_physio.' in filename:
         return False
-    if '_stim.' in str(filename):
+    if '_stim.' in filename:
         return False
-    # Regular expression pattern
-    pattern = r'sub-[^_]+'
     # Extracting substring using regex
-    match = search(pattern, str(filename))
+    match = BIDS_SUBJECT_PATTERN.search(filename)
     if not match:
         return False
 
@@ -79,6 +113,31 @@ def is_dicom_file(filename: Union[str, Path]):
     return False
 
 
+def slice_fingerprint(dicom: pydicom.Dataset) -> tuple:
+    """
+    Returns the values of SLICE_FINGERPRINT_TAGS from the dicom header. Two
+    slices with the same fingerprint belong to the same run and have the
+    same echo parameters, so only one of them needs to be processed.
+    Multi-valued elements are converted to tuples, so that fingerprints
+    can be collected in a set.
+
+    Parameters
+    ----------
+    dicom : pydicom.Dataset
+        dicom object read from pydicom.read_file
+
+    Returns
+    -------
+    tuple : values of the tags, None for the tags which are not present
+    """
+    # called for every slice, so look up each element once, inline
+    elements = (dicom.get(tag) for tag in SLICE_FINGERPRINT_TAGS)
+    values = (element.value if element is not None else None
+              for element in elements)
+    return tuple(tuple(value) if isinstance(value, MultiValue) else value
+                 for value in values)
+
+
 def is_valid_inclusion(dicom: pydicom.FileDataset,
                        include_phantom=False,
                        include_moco=False,
@@ -120,8 +179,8 @@ def is_valid_inclusion(dicom: pydicom.FileDataset,
     # TODO: make the check more concrete. See dicom2nifti for details
 
     # check quality control subject :  Not present dicom headers
-    series_desc = dicom.get('SeriesDescription', None)
-    image_type = dicom.get('ImageType', None)
+    series_desc = get_tag_value(dicom, SERIES_DESCRIPTION_TAG)
+    image_type = get_tag_value(dicom, IMAGE_TYPE_TAG)
 
     if series_desc is None:
         return False
@@ -188,13 +247,34 @@ def is_phantom(dicom: pydicom.FileDataset) -> bool:
     bool
     """
 
-    sid = str(dicom.get('PatientID', None))
-    sex = str(dicom.get('PatientSex', None))
-    age = str(dicom.get('PatientAge', None))
-    if sid and ('phantom' in sid.lower()):
+    sid = get_tag_value(dicom, PATIENT_ID_TAG)
+    sex = get_tag_value(dicom, PATIENT_SEX_TAG)
+    age = get_tag_value(dicom, PATIENT_AGE_TAG)
+    if sid and ('phantom' in str(sid).lower()):
         return True
-    if sex and (sex.lower() == 'o'):
+    if sex and (str(sex).lower() == 'o'):
         return True
     if age == '001D':
         return True
     return False
+
+
+def get_tag_value(dicom: pydicom.Dataset, tag: int):
+    """
+    Returns the value of a data element, accessed directly by its integer
+    tag. Unlike str(dicom.get(keyword)), a missing element gives None and
+    not the string 'None'.
+
+    Parameters
+    ----------
+    dicom : pydicom.Dataset
+        dicom object read from pydicom.dcmread
+    tag : int
+        DICOM tag e.g. 0x00100020 for PatientID
+
+    Returns
+    -------
+    value of the data element, or None if it is not present
+    """
+    element = dicom.get(tag)
+    return element.value if element is not None else None
@@ -1,11 +1,14 @@
 import errno
 import json
+import os
 import random
 import shutil
 import tempfile
 import zipfile
 from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
+from typing import Tuple
 
 import pydicom
 from MRdataset.dicom_utils import is_bids_file
@@ -17,6 +20,9 @@ from MRdataset.utils import convert2ascii
 THIS_DIR = Path(__file__).parent.resolve()
 
 
+# The sample datasets are extracted once and never modified, so the checks
+#   for an existing extraction are done once per process
+@lru_cache(maxsize=None)
 def sample_dicom_dataset(tmp_path=None):
     if not tmp_path:
         tmp_path = tempfile.gettempdir()
@@ -29,6 +35,7 @@ def sample_dicom_dataset(tmp_path=None):
     return DATA_ROOT / 'example_dicom_data'
 
 
+@lru_cache(maxsize=None)
 def sample_bids_dataset(tmp_path=None):
     if not tmp_path:
         tmp_path = tempfile.gettempdir()
@@ -44,6 +51,7 @@ def sample_bids_dataset(tmp_path=None):
     return DATA_ROOT / 'example_bids_dataset'
 
 
+@lru_cache(maxsize=None)
 def sample_vertical_dataset(tmp_path=None):
     if not tmp_path:
         tmp_path = tempfile.gettempdir()
@@ -56,17 +64,47 @@ def sample_vertical_dataset(tmp_path=None):
     return DATA_ROOT / 'vertical'
 
 
+@lru_cache(maxsize=8)
+def _scan_dicoms(src: str) -> Tuple[Path, ...]:
+    """
+    Lists the dicom files under src, walking the tree once with os.scandir.
+    The sample datasets are extracted once and never modified, so the list
+    is cached and shared by all the datasets simulated from the same source.
+    """
+    files = []
+    stack = [src]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith('.dcm'):
+                    files.append(entry.path)
+    files.sort()
+    return tuple(Path(f) for f in files)
+
+
+def _read_header(filepath):
+    """
+    Reads the dicom file without the pixel data. MRdataset never reads the
+    pixel data, so the simulated datasets are written without it, which
+    makes them much faster to both create and load.
+    """
+    return pydicom.dcmread(filepath, stop_before_pixels=True)
+
+
 def make_vertical_test_dataset(num_sequences) -> Path:
     src_dir, dest_dir = setup_directories(sample_vertical_dataset())
-    dcm_list = list(src_dir.glob('**/*.dcm'))
+    dcm_list = _scan_dicoms(str(src_dir))
 
     seq_names = defaultdict(set)
     while True:
         filepath = random.choice(dcm_list)
-        dicom = pydicom.read_file(filepath)
-        export_dicom_file(dicom, filepath, dest_dir)
+        dicom = _read_header(filepath)
         subject_id = dicom.get('PatientID', None)
-        seq_names[subject_id].add(dicom.get('SeriesDescription', None))
+        series_desc = dicom.get('SeriesDescription', None)
+        export_dicom_file(dicom, filepath, dest_dir, subject_id, series_desc)
+        seq_names[subject_id].add(series_desc)
         if len(seq_names[subject_id]) >= num_sequences:
             break
     return dest_dir
@@ -77,20 +115,21 @@ def make_compliant_test_dataset(num_subjects,
                                 echo_train_length,
                                 flip_angle) -> Path:
     src_dir, dest_dir = setup_directories(sample_dicom_dataset())
-    dcm_list = list(src_dir.glob('**/*.dcm'))
+    dcm_list = _scan_dicoms(str(src_dir))
 
     subject_names = set()
     i = 0
     while len(subject_names) < num_subjects:
         filepath = dcm_list[i]
-        dicom = pydicom.read_file(filepath)
+        dicom = _read_header(filepath)
 
         dicom.RepetitionTime = repetition_time
         dicom.EchoTrainLength = echo_train_length
         dicom.FlipAngle = flip_angle
 
-        export_dicom_file(dicom, filepath, dest_dir)
-        subject_names.add(dicom.get('PatientID', None))
+        subject_id = dicom.get('PatientID', None)
+        export_dicom_file(dicom, filepath, dest_dir, subject_id)
+        subject_names.add(subject_id)
         i += 1
     return dest_dir
 
@@ -112,6 +151,15 @@ def make_compliant_bids_dataset(num_subjects,
         except StopIteration:
             break
 
+        # only one file is exported per subject, so the subject is checked
+        #   before the file is read
+        try:
+            subject_name = str(filepath).split('/')[3]
+        except IndexError:
+            continue
+        if subject_name in subject_names:
+            continue
+
         try:
             with open(filepath, "r") as read_file:
                 parameters = json.load(read_file)
@@ -120,14 +168,8 @@ def make_compliant_bids_dataset(num_subjects,
         parameters['RepetitionTime'] = repetition_time
         parameters['EchoTrainLength'] = echo_train_length
         parameters['FlipAngle'] = flip_angle
-        try:
-            subject_name = str(filepath).split('/')[3]
-            if subject_name in subject_names:
-                continue
-            subject_names.add(subject_name)
-            export_bids_file(parameters, filepath, dest_dir, src_dir)
-        except IndexError:
-            pass
+        subject_names.add(subject_name)
+        export_bids_file(parameters, filepath, dest_dir, src_dir)
     return dest_dir
 
 
@@ -136,23 +178,26 @@ def make_multi_echo_dataset(num_subjects,
                             echo_train_length,
                             flip_angle) -> Path:
     src_dir, dest_dir = setup_directories(sample_dicom_dataset())
-    dcm_list = list(src_dir.glob('**/*.dcm'))
+    dcm_list = _scan_dicoms(str(src_dir))
 
     subject_names = set()
     i = 0
     while len(subject_names) < num_subjects:
         filepath = dcm_list[i]
-        dicom = pydicom.read_file(filepath)
+        dicom = _read_header(filepath)
 
         dicom.RepetitionTime = repetition_time
         dicom.EchoTrainLength = echo_train_length
         dicom.FlipAngle = flip_angle
         dicom.EchoTime = echo_train_length
-        export_dicom_file(dicom, filepath, dest_dir)
+        subject_id = dicom.get('PatientID', None)
+        series_desc = dicom.get('SeriesDescription', None)
+        export_dicom_file(dicom, filepath, dest_dir, subject_id, series_desc)
         dicom.EchoTime = echo_train_length*2
         newfilepath = filepath.parent/(filepath.stem+'2.dcm')
-        export_dicom_file(dicom, newfilepath, dest_dir)
-        subject_names.add(dicom.get('PatientID', None))
+        export_dicom_file(dicom, newfilepath, dest_dir, subject_id,
+                          series_desc)
+        subject_names.add(subject_id)
         i += 1
     return dest_dir
 
@@ -160,7 +205,6 @@ def make_multi_echo_dataset(num_subjects,
 def setup_directories(src):
     src_dir = Path(src).resolve()
     if not src_dir.exists():
-        print(src_dir)
         raise FileNotFoundError("Source Directory {} not found".format(src_dir))
 
     temp_dir = tempfile.mkdtemp()
@@ -188,7 +232,6 @@ def make_test_dataset(num_noncompliant_subjects,
                       echo_train_length,
                       flip_angle):
     src_dir, dest_dir = setup_directories(compl_data_xnat)  # noqa
-    print()
     # copyeverything(src_dir, dest_dir)
     dataset_info = defaultdict(set)
     modalities = [s.name for s in src_dir.iterdir() if (s.is_dir() and
@@ -198,7 +241,7 @@ def make_test_dataset(num_noncompliant_subjects,
         subject_paths = [s for s in (src_dir / modality).iterdir()]
         for sub_path in subject_paths:
             for filepath in sub_path.glob('*.dcm'):
-                dicom = pydicom.read_file(filepath)
+                dicom = _read_header(filepath)
                 export_dicom_file(dicom, filepath, dest_dir)
 
     for i, modality in enumerate(modalities):
@@ -208,7 +251,7 @@ def make_test_dataset(num_noncompliant_subjects,
         for j in range(count):
             sub_path = subject_paths[j]
             for filepath in sub_path.glob('**/*.dcm'):
-                dicom = pydicom.read_file(filepath)
+                dicom = _read_header(filepath)
                 patient_id = str(dicom.get('PatientID', None))
                 dicom.RepetitionTime = repetition_time
                 dicom.EchoTrainLength = echo_train_length
@@ -220,11 +263,14 @@ def make_test_dataset(num_noncompliant_subjects,
     return dest_dir, dataset_info
 
 
-def export_dicom_file(dicom, filepath, out_dir):
-    patient_id = dicom.get('PatientID', None)
-    series_desc = dicom.get('SeriesDescription', None)
-    series_number = dicom.get('SeriesNumber', None)
-    series_desc = convert2ascii(series_desc.replace(' ', '_'))  # + '_' + str(series_number)
+def export_dicom_file(dicom, filepath, out_dir, patient_id=None,
+                      series_desc=None):
+    # the callers usually have read the ids already, look them up otherwise
+    if patient_id is None:
+        patient_id = dicom.get('PatientID', None)
+    if series_desc is None:
+        series_desc = dicom.get('SeriesDescription', None)
+    series_desc = convert2ascii(series_desc.replace(' ', '_'))
     output_path = out_dir / series_desc / patient_id
     number = dicom.get('InstanceNumber', None)
     output_path.mkdir(exist_ok=True, parents=True)
@@ -59,6 +59,57 @@ def test_add(args):
                 ds.add(subject, session, seq_id, run, None)
 
 
+@settings(suppress_health_check=[HealthCheck.too_slow], max_examples=10, deadline=None)
+@given(args=dcm_dataset_strategy)
+def test_add_many(args):
+    ds, attributes = args
+    ds.load()
+    records = [(subject, session, seq_id, run, seq)
+               for seq_id in ds.get_sequence_ids()
+               for subject, session, run, seq in ds.traverse_horizontal(seq_id)]
+
+    other = type(ds)(name=attributes['name'],
+                     data_source=attributes['fake_ds_dir'],
+                     config_path=attributes['config_path'],
+                     output_dir=ds.output_dir)
+    # duplicate records are only added once
+    other.add_many(records + records)
+    assert other._flat_map == ds._flat_map
+    assert other._subj_ids == ds._subj_ids
+    assert other._seq_ids == ds._seq_ids
+    for seq_id in ds.get_sequence_ids():
+        assert other._seqs_map[seq_id] == ds._seqs_map[seq_id]
+
+    with pytest.raises(TypeError):
+        other.add_many([('sub', 'ses', 'seq', 'run', None)])
+
+    # a bad record in the middle of a batch leaves the dataset unchanged
+    empty = type(ds)(name=attributes['name'],
+                     data_source=attributes['fake_ds_dir'],
+                     config_path=attributes['config_path'],
+                     output_dir=ds.output_dir)
+    bad_record = ('sub', 'ses', 'seq', 'run', None)
+    half = len(records) // 2
+    with pytest.raises(TypeError):
+        empty.add_many(records[:half] + [bad_record] + records[half:])
+    assert not empty._flat_map
+    assert not empty._tree_map
+    assert not empty._seqs_map
+    assert not empty._sess_map
+    assert not empty._subj_ids
+    assert not empty._seq_ids
+
+    # and so does a failing iterable of records
+    def failing_records():
+        yield from records[:half]
+        raise ValueError('Unable to read record')
+
+    with pytest.raises(ValueError):
+        empty.add_many(failing_records())
+    assert not empty._flat_map
+    assert not empty._seqs_map
+
+
 @settings(suppress_health_check=[HealthCheck.too_slow], max_examples=50, deadline=None)
 @given(args=dcm_dataset_strategy)
 def test_equality(args):
@@ -1,4 +1,5 @@
 import glob
+import multiprocessing
 import shutil
 import tempfile
 from pathlib import Path
@@ -8,7 +9,9 @@ import pytest
 from hypothesis import given, settings, HealthCheck
 
 from MRdataset import import_dataset
+from MRdataset.bids import BidsDataset
 from MRdataset.tests.simulate import make_compliant_bids_dataset
+from MRdataset.utils import map_dataset_folders
 
 THIS_DIR = Path(__file__).parent.resolve()
 
@@ -98,3 +101,38 @@ def test_empty_folders():
                              output_dir=folder_path, name='test_dataset',
                              ds_format='bids')
         assert len(mrd.get_sequence_ids()) == 0
+
+
+def test_parallel_load():
+    fake_ds_dir = make_compliant_bids_dataset(3, 2, 2, 90)
+    mrd = import_dataset(data_source=fake_ds_dir, ds_format='bids',
+                         config_path=THIS_DIR / 'resources/bids-config.json',
+                         output_dir=fake_ds_dir, name='test_dataset',
+                         n_jobs=2, n_threads=4)
+    mrd_seq = import_dataset(data_source=fake_ds_dir, ds_format='bids',
+                             config_path=THIS_DIR / 'resources/bids-config.json',
+                             output_dir=fake_ds_dir, name='test_dataset')
+    assert mrd._flat_map.keys() == mrd_seq._flat_map.keys()
+    shutil.rmtree(fake_ds_dir)
+
+
+def test_parallel_load_bad_folder():
+    fake_ds_dir = make_compliant_bids_dataset(3, 2, 2, 90)
+    folders = [p for p in Path(fake_ds_dir).rglob('*') if p.is_dir()]
+    # a folder which was removed after it was listed can't be read
+    folders.append(Path(fake_ds_dir) / 'sub-removed' / 'ses-01' / 'anat')
+    mrd = BidsDataset(name='test_dataset', data_source=fake_ds_dir,
+                      config_path=THIS_DIR / 'resources/bids-config.json',
+                      output_dir=fake_ds_dir)
+
+    sequential = map(mrd._read_folder, folders)
+    # spawn copies the dataset to the workers by pickling it
+    parallel = map_dataset_folders(
+        mrd, '_read_folder', folders, max_workers=2,
+        mp_context=multiprocessing.get_context('spawn'))
+    results = []
+    for processed in (sequential, parallel):
+        results.append({(seq.subject_id, seq.session_id, seq.name, seq.run_id)
+                        for sequences in processed for seq in sequences})
+    assert results[0] and results[0] == results[1]
+    shutil.rmtree(fake_ds_dir)
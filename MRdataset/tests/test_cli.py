@@ -19,7 +19,8 @@ def test_load(args):
     with tempfile.TemporaryDirectory() as tempdir:
         sys.argv = shlex.split(f'mrds --data-source {attributes["fake_ds_dir"]} '
                                f'--config {attributes["config_path"]} --name {ds1.name} '
-                               f'--format dicom --output-dir {tempdir}')
+                               f'--format dicom --output-dir {tempdir} '
+                               f'--n-jobs 2')
         cli()
         ds2 = load_mr_dataset(f"/{tempdir}/{ds1.name}.mrds.pkl")
         assert ds1 == ds2
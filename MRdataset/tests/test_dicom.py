@@ -2,6 +2,7 @@
 
 """Tests for `MRdataset` package."""
 
+import os
 import shutil
 import tempfile
 from pathlib import Path
@@ -11,6 +12,7 @@ import pytest
 from hypothesis import given, settings, HealthCheck
 
 from MRdataset import import_dataset
+from MRdataset.dicom import DicomDataset
 from MRdataset.tests.simulate import make_compliant_test_dataset, \
     make_multi_echo_dataset
 
@@ -77,6 +79,95 @@ def set_parameters(mrd, repetition_time, echo_train_length, flip_angle):
         assert set(mrd.get_subject_ids(seq_id)) == mrd_num_subjects
 
 
+def test_parallel_load():
+    fake_ds_dir = make_compliant_test_dataset(3, 2, 2, 90)
+    mrd = import_dataset(fake_ds_dir,
+                         config_path=THIS_DIR / 'resources/mri-config.json',
+                         output_dir=fake_ds_dir, name='test_dataset',
+                         n_jobs=2, n_threads=4)
+    set_parameters(mrd, 2, 2, 90)
+    mrd_seq = import_dataset(fake_ds_dir,
+                             config_path=THIS_DIR / 'resources/mri-config.json',
+                             output_dir=fake_ds_dir, name='test_dataset')
+    assert set(mrd.get_sequence_ids()) == set(mrd_seq.get_sequence_ids())
+    for seq_id in mrd.get_sequence_ids():
+        assert (set(mrd.get_subject_ids(seq_id))
+                == set(mrd_seq.get_subject_ids(seq_id)))
+    shutil.rmtree(fake_ds_dir)
+
+
+def test_parallel_load_bad_folder():
+    fake_ds_dir = make_compliant_test_dataset(3, 2, 2, 90)
+    folders = [p for p in Path(fake_ds_dir).rglob('*') if p.is_dir()]
+    # a folder which was removed after it was listed can't be read
+    folders.append(Path(fake_ds_dir) / 'removed')
+
+    results = []
+    for n_jobs in (1, 2):
+        mrd = DicomDataset(name='test_dataset', data_source=fake_ds_dir,
+                           config_path=THIS_DIR / 'resources/mri-config.json',
+                           output_dir=fake_ds_dir, n_jobs=n_jobs)
+        processed = dict(mrd._process_folders(folders))
+        assert processed[Path(fake_ds_dir) / 'removed'] is None
+        results.append({folder: seq is None
+                        for folder, seq in processed.items()})
+    assert results[0] == results[1]
+    shutil.rmtree(fake_ds_dir)
+
+
+def test_n_threads():
+    fake_ds_dir = make_compliant_test_dataset(2, 2, 2, 90)
+    for n_threads in (None, 0, -1):
+        mrd = DicomDataset(name='test_dataset', data_source=fake_ds_dir,
+                           config_path=THIS_DIR / 'resources/mri-config.json',
+                           output_dir=fake_ds_dir, n_threads=n_threads)
+        assert mrd.n_threads == (os.cpu_count() or 1)
+        mrd.load()
+        set_parameters(mrd, 2, 2, 90)
+    shutil.rmtree(fake_ds_dir)
+
+
+def test_stale_folder_cache(caplog):
+    fake_ds_dir = Path(make_compliant_test_dataset(3, 2, 2, 90))
+    # the output files would change the modification time of the root
+    output_dir = tempfile.mkdtemp()
+    kwargs = dict(config_path=THIS_DIR / 'resources/mri-config.json',
+                  output_dir=output_dir, name='test_dataset')
+    import_dataset(fake_ds_dir, cache_folders=True, **kwargs)
+
+    # a folder removed below the top level doesn't change the cache key
+    seq_dir = next(p for p in fake_ds_dir.iterdir() if p.is_dir())
+    stat = seq_dir.stat()
+    shutil.rmtree(next(p for p in seq_dir.iterdir() if p.is_dir()))
+    os.utime(seq_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    mrd = import_dataset(fake_ds_dir, cache_folders=True, **kwargs)
+    assert 'is out of date' in caplog.text
+    mrd_walk = import_dataset(fake_ds_dir, **kwargs)
+    assert set(mrd.get_sequence_ids()) == set(mrd_walk.get_sequence_ids())
+    for seq_id in mrd.get_sequence_ids():
+        assert (set(mrd.get_subject_ids(seq_id))
+                == set(mrd_walk.get_subject_ids(seq_id)))
+    shutil.rmtree(fake_ds_dir)
+    shutil.rmtree(output_dir)
+
+
+def test_fast_scan():
+    fake_ds_dir = make_multi_echo_dataset(4, 2, 2, 90)
+    mrd = import_dataset(fake_ds_dir,
+                         config_path=THIS_DIR / 'resources/mri-config-2.json',
+                         output_dir=fake_ds_dir, name='test_dataset',
+                         fast_scan=True)
+    set_parameters(mrd, 2, 2, 90)
+    shutil.rmtree(fake_ds_dir)
+
+    files = [Path(f'{i}.dcm') for i in range(100)]
+    sampled = DicomDataset._sample_dcm_files(files)
+    assert sampled[0] == files[0]
+    assert len(sampled) == 9
+    assert DicomDataset._sample_dcm_files(files[:3]) == files[:3]
+
+
 def test_config_dict():
     fake_ds_dir = make_compliant_test_dataset(1, 1, 1, 1)
     with pytest.raises(FileNotFoundError):
@@ -1,4 +1,6 @@
 import json
+import logging
+import multiprocessing
 import os
 import re
 import tempfile
@@ -9,11 +11,14 @@ from hypothesis import given, strategies as st, settings
 from hypothesis.strategies import characters
 from pydicom import dcmread
 
-from MRdataset.dicom_utils import is_dicom_file, is_valid_inclusion
+from MRdataset import logger
+from MRdataset.dicom_utils import is_dicom_file, is_valid_inclusion, \
+    get_tag_value, PATIENT_ID_TAG, PATIENT_AGE_TAG, slice_fingerprint
 from MRdataset.utils import convert2ascii, read_json, \
     is_folder_with_no_subfolders, find_terminal_folders, \
     check_mrds_extension, valid_dirs, \
-    folders_with_min_files  # Import your function from the correct module
+    folders_with_min_files, files_in_folder, cached_folders_with_min_files, \
+    process_map_unordered
 
 
 def test_valid_dicom_file(tmp_path=None):
@@ -82,6 +87,23 @@ def test_valid_inclusion(valid_dicom_file):
     dcm.PatientAge = '001D'
     assert not is_valid_inclusion(dcm, include_phantom=False)
 
+def test_get_tag_value(valid_dicom_file):
+    dcm = dcmread(valid_dicom_file)
+    assert get_tag_value(dcm, PATIENT_ID_TAG) == dcm.PatientID
+    del dcm.PatientAge
+    assert get_tag_value(dcm, PATIENT_AGE_TAG) is None
+
+
+def test_slice_fingerprint(valid_dicom_file):
+    dcm = dcmread(valid_dicom_file)
+    other = dcmread(valid_dicom_file)
+    other.SliceLocation = 1000
+    assert slice_fingerprint(dcm) == slice_fingerprint(other)
+    assert slice_fingerprint(dcm) in {slice_fingerprint(other)}
+    other.EchoTime = 1000
+    assert slice_fingerprint(dcm) != slice_fingerprint(other)
+
+
 def test_invalid_inclusion_derived(derived_dicom_file):
     dcm = dcmread(derived_dicom_file)  # Replace with the actual path
     result = is_valid_inclusion(dcm)
@@ -329,6 +351,101 @@ def test_find_folders_with_min_files():
         assert set(terminal_folders) == expected
 
 
+def test_find_folders_with_min_files_nested():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        root = Path(tmpdirname).resolve()
+        leaf1 = root / "sub-01" / "ses-01" / "t1w"
+        leaf2 = root / "sub-02" / "t1w"
+        leaf3 = root / "sub-02" / "empty"
+        for folder in [leaf1, leaf2, leaf3]:
+            folder.mkdir(parents=True)
+        for folder in [leaf1, leaf2]:
+            for count in range(2):
+                (folder / f"file{count}.dcm").touch()
+        # files in non-terminal folders are not counted
+        (root / "sub-02" / "notes.dcm").touch()
+
+        terminal_folders = folders_with_min_files(root, "*.dcm", min_count=2)
+        assert set(terminal_folders) == {leaf1, leaf2}
+
+        terminal_folders = folders_with_min_files(root, "*.dcm", min_count=2,
+                                                  max_workers=4)
+        assert set(terminal_folders) == {leaf1, leaf2}
+
+        # the threaded walk can be stopped after the first folder
+        terminal_folders = folders_with_min_files(root, "*.dcm", min_count=2,
+                                                  max_workers=4)
+        assert next(terminal_folders) in {leaf1, leaf2}
+        terminal_folders.close()
+
+        terminal_folders = folders_with_min_files(leaf1, "*.dcm", min_count=2)
+        assert list(terminal_folders) == [leaf1]
+
+
+def test_cached_folders_with_min_files():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        root = Path(tmpdirname).resolve() / "data"
+        cache_path = Path(tmpdirname) / "cache.json"
+        leaf1 = root / "sub-01" / "t1w"
+        leaf1.mkdir(parents=True)
+        (leaf1 / "file.dcm").touch()
+
+        folders = cached_folders_with_min_files(root, cache_path, "*.dcm",
+                                                min_count=1)
+        assert folders == [leaf1]
+        assert str(root) in read_json(cache_path)
+
+        # changes deep in the tree do not invalidate the cache
+        leaf2 = root / "sub-01" / "fmri"
+        leaf2.mkdir()
+        (leaf2 / "file.dcm").touch()
+        folders = cached_folders_with_min_files(root, cache_path, "*.dcm",
+                                                min_count=1)
+        assert folders == [leaf1]
+
+        # a different pattern is not served from the cache
+        folders = cached_folders_with_min_files(root, cache_path, "*",
+                                                min_count=1)
+        assert set(folders) == {leaf1, leaf2}
+
+        # the cache is refreshed, if root is modified
+        leaf3 = root / "sub-02"
+        leaf3.mkdir()
+        (leaf3 / "file.dcm").touch()
+        os.utime(root, (0, 1))
+        folders = cached_folders_with_min_files(root, cache_path, "*.dcm",
+                                                min_count=1)
+        assert set(folders) == {leaf1, leaf2, leaf3}
+
+        # a folder removed deep in the tree is still returned from the
+        #   cache, until the cache is refreshed
+        (leaf2 / "file.dcm").unlink()
+        leaf2.rmdir()
+        os.utime(root, (0, 1))
+        folders = cached_folders_with_min_files(root, cache_path, "*.dcm",
+                                                min_count=1)
+        assert set(folders) == {leaf1, leaf2, leaf3}
+        folders = cached_folders_with_min_files(root, cache_path, "*.dcm",
+                                                min_count=1, refresh=True)
+        assert set(folders) == {leaf1, leaf3}
+        folders = cached_folders_with_min_files(root, cache_path, "*.dcm",
+                                                min_count=1)
+        assert set(folders) == {leaf1, leaf3}
+
+
+def test_files_in_folder():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        folder = Path(tmpdirname)
+        for name in ["b.dcm", "a.dcm", "c.json", "d.dcm.bak"]:
+            (folder / name).touch()
+        (folder / "e.dcm").mkdir()
+
+        expected = [str(folder / "a.dcm"), str(folder / "b.dcm")]
+        assert files_in_folder(folder, "*.dcm") == expected
+        assert files_in_folder(folder, "[ab].dcm") == expected
+        assert len(files_in_folder(folder)) == 4
+
+
 # Define a strategy for generating valid paths (strings)
 @st.composite
 def valid_paths(draw):
@@ -400,3 +517,26 @@ def test_valid_dirs_with_none_raises_error():
 def test_valid_dirs_with_invalid_input_raises_error(invalid_input):
     with pytest.raises(ValueError):
         valid_dirs(invalid_input)
+
+
+def _log_error(item):
+    logger.error(f'Error logged by a worker for item {item}')
+    return item
+
+
+def test_process_map_unordered_spawn_logging():
+    log_file = next(handler.baseFilename for handler in logger.handlers
+                    if isinstance(handler, logging.FileHandler))
+    logger.error('Error logged by the main process')
+
+    # spawned workers import MRdataset again, which must not truncate the log
+    results = process_map_unordered(
+        _log_error, range(4), max_workers=2,
+        mp_context=multiprocessing.get_context('spawn'))
+    assert sorted(results) == list(range(4))
+
+    with open(log_file) as f:
+        log = f.read()
+    assert 'Error logged by the main process' in log
+    for item in range(4):
+        assert f'Error logged by a worker for item {item}' in log
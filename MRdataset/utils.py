@@ -1,14 +1,24 @@
 import json
+import multiprocessing
+import os
+import queue
 import re
 import tempfile
+import threading
 import time
 import unicodedata
 import uuid
 from collections.abc import Iterable
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                FIRST_COMPLETED, as_completed, wait)
+from fnmatch import fnmatch
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Iterator, Tuple, Callable
 
-from MRdataset.config import MRDS_EXT
+from MRdataset import logger
+from MRdataset.config import MRDS_EXT, MRDS_BUFFER_SIZE
 
 
 def random_name() -> str:
@@ -36,42 +46,414 @@ def timestamp() -> str:
 
 def folders_with_min_files(root: Union[Path, str],
                            pattern: Optional[str] = "*.dcm",
-                           min_count=3) -> List[Path]:
+                           min_count=3,
+                           max_workers=1) -> Iterator[Path]:
     """
     Returns all the folders with at least min_count of files
-    matching the pattern. One at time via generator.
+    matching the pattern. One at time via generator. The folder tree is
+    walked lazily, so the first folders are yielded before the rest of
+    the tree has been listed.
 
     Parameters
     ----------
-    root : List[Path]
-        List of folder paths
+    root : Path | str
+        path to the root folder
     pattern : str
         pattern to filter files
     min_count : int
         size representing the number of files in folder
         matching the input pattern
-
-    Returns
-    -------
-    List of folders
+    max_workers : int
+        number of threads used to walk the top-level sub-folders of root
+        concurrently. Listing folders is dominated by filesystem latency
+        (e.g. on network storage), so threads help despite the GIL.
+        Folders are yielded in arbitrary order if more than 1.
+        Default is 1, i.e. walk sequentially.
+
+    Yields
+    ------
+    folder : Path
+        terminal folder with at least min_count matching files
     """
 
     if not isinstance(root, (Path, str)):
         raise ValueError('root must be a Path-like object (str or Path)')
 
-    if not root.exists():
+    if not Path(root).exists():
         raise ValueError('Root folder does not exist')
     root = Path(root).resolve()
 
-    terminals = find_terminal_folders(root)
+    if max_workers > 1:
+        walker = _walk_terminal_folders_threaded(root, pattern, max_workers,
+                                                 max_count=min_count)
+    else:
+        walker = _walk_terminal_folders(root, pattern, max_count=min_count)
 
-    for folder in terminals:
-        if len([file_ for file_ in folder.rglob(pattern)]) >= min_count:
+    for folder, num_files in walker:
+        if num_files >= min_count:
             yield folder
 
     return
 
 
+def cached_folders_with_min_files(root: Union[Path, str],
+                                  cache_path: Union[Path, str],
+                                  pattern: Optional[str] = "*.dcm",
+                                  min_count=3,
+                                  max_workers=1,
+                                  refresh=False) -> List[Path]:
+    """
+    Same as folders_with_min_files, but the list of folders is saved to a
+    json file, and re-used as long as the modification time of root, the
+    pattern and min_count have not changed. This avoids walking the whole
+    tree again, which is slow on network filesystems.
+
+    Note that the modification time of root changes only when entries are
+    added to or removed from root itself, so the cache is meant for datasets
+    that are not modified in place. Folders added or removed deeper in the
+    tree are not noticed here: added folders are missed until the cache is
+    refreshed, and removed folders are still returned. The loaders refresh
+    the cache when a returned folder turns out to be missing, see
+    DicomDataset.load.
+
+    Parameters
+    ----------
+    root : Path | str
+        path to the root folder
+    cache_path : Path | str
+        path to the json file storing the folders for each root
+    pattern : str
+        pattern to filter files
+    min_count : int
+        size representing the number of files in folder
+        matching the input pattern
+    max_workers : int
+        number of threads used to walk the tree, if the cache can't be
+        used. See folders_with_min_files.
+    refresh : bool
+        Whether to walk the tree again and update the cache, even if the
+        cached folders could be used. Default is False.
+
+    Returns
+    -------
+    folders : List[Path]
+        terminal folders with at least min_count matching files
+    """
+    if not isinstance(root, (Path, str)):
+        raise ValueError('root must be a Path-like object (str or Path)')
+
+    if not Path(root).exists():
+        raise ValueError('Root folder does not exist')
+    root = Path(root).resolve()
+
+    try:
+        cache = read_json(cache_path)
+    except (FileNotFoundError, ValueError):
+        cache = dict()
+
+    cache_key = [root.stat().st_mtime, pattern, min_count]
+    entry = cache.get(str(root))
+    if not refresh and entry is not None and entry.get('key') == cache_key:
+        return [Path(folder) for folder in entry['folders']]
+
+    folders = list(folders_with_min_files(root, pattern, min_count,
+                                          max_workers=max_workers))
+    cache[str(root)] = {'key': cache_key,
+                        'folders': [str(folder) for folder in folders]}
+    # the cache is only read back by this function, so it is written without
+    #   indentation, which is faster to dump and parse for large datasets
+    with open(cache_path, 'w', buffering=MRDS_BUFFER_SIZE) as f:
+        json.dump(cache, f, separators=(',', ':'))
+    return folders
+
+
+def _walk_terminal_folders(root: Path,
+                           pattern: str,
+                           max_count: Optional[int] = None
+                           ) -> Iterator[Tuple[Path, int]]:
+    """
+    Walks the tree under root depth-first using os.scandir, and yields
+    each terminal folder (i.e. a folder without any sub-folders) along with
+    the number of files in it matching the pattern. The files are counted
+    from the same directory listing used to look for sub-folders, so each
+    folder is listed exactly once.
+
+    Parameters
+    ----------
+    root : Path
+        path to the root folder
+    pattern : str
+        pattern to filter files
+    max_count : int
+        stop matching files against the pattern once max_count files are
+        found in a folder, i.e. the count is capped at max_count. The
+        listing still has to be completed to look for sub-folders.
+        Default is None, i.e. count all the files.
+    """
+    if not root.is_dir():
+        return
+
+    matches = _name_matcher(pattern)
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        sub_dirs = list()
+        num_files = 0
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    sub_dirs.append(entry.path)
+                elif max_count is not None and num_files >= max_count:
+                    continue
+                elif matches(entry.name):
+                    num_files += 1
+
+        if sub_dirs:
+            # reversed, so that folders are popped in the listed order
+            stack.extend(reversed(sub_dirs))
+        else:
+            yield Path(current), num_files
+
+
+def _walk_terminal_folders_threaded(root: Path,
+                                    pattern: str,
+                                    max_workers: int,
+                                    max_count: Optional[int] = None
+                                    ) -> Iterator[Tuple[Path, int]]:
+    """
+    Same as _walk_terminal_folders, but each top-level sub-folder of root
+    is walked in a separate thread. The folders are yielded as soon as they
+    are found by any of the threads.
+
+    Parameters
+    ----------
+    root : Path
+        path to the root folder
+    pattern : str
+        pattern to filter files
+    max_workers : int
+        maximum number of threads
+    max_count : int
+        cap on the number of matching files counted per folder
+    """
+    if not root.is_dir():
+        return
+
+    with os.scandir(root) as entries:
+        top_dirs = [Path(entry.path) for entry in entries if entry.is_dir()]
+
+    if not top_dirs:
+        # root itself is the only terminal folder
+        yield from _walk_terminal_folders(root, pattern, max_count)
+        return
+
+    # each thread puts the folders it finds in the queue, followed by None
+    #   once its walk is complete. The walks stop early, if the caller stops
+    #   consuming the folders.
+    found = queue.Queue()
+    stop = threading.Event()
+
+    def walk(top_dir):
+        try:
+            for item in _walk_terminal_folders(top_dir, pattern, max_count):
+                if stop.is_set():
+                    break
+                found.put(item)
+        finally:
+            found.put(None)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(walk, top_dir) for top_dir in top_dirs]
+        try:
+            num_running = len(futures)
+            while num_running:
+                item = found.get()
+                if item is None:
+                    num_running -= 1
+                else:
+                    yield item
+        finally:
+            stop.set()
+        # raises the first error from the walks, if any
+        for future in futures:
+            future.result()
+
+
+# Dataset instance shared by the worker processes of map_dataset_folders. It
+#   is set once per worker by _init_dataset_worker, so that the (potentially
+#   large) dataset state is not pickled again for every folder.
+_WORKER_DATASET = None
+
+
+def map_dataset_folders(dataset,
+                        method: str,
+                        folders: Iterable,
+                        max_workers: int,
+                        mp_context=None) -> Iterator:
+    """
+    Calls a method of the dataset with each folder, in a pool of worker
+    processes, and yields the results in arbitrary order. The dataset is
+    sent to each worker process only once. See process_map_unordered.
+
+    Parameters
+    ----------
+    dataset : BaseDataset
+        picklable dataset, whose state is copied to each worker process
+    method : str
+        name of the method of the dataset called with each folder
+    folders : Iterable[Path]
+        folders to be processed
+    max_workers : int
+        number of worker processes
+    mp_context : multiprocessing.context.BaseContext
+        context used to start the worker processes, see
+        process_map_unordered
+
+    Yields
+    ------
+    result of the method for each folder
+    """
+    return process_map_unordered(partial(_call_worker_dataset, method),
+                                 folders,
+                                 max_workers=max_workers,
+                                 initializer=_init_dataset_worker,
+                                 initargs=(dataset,),
+                                 mp_context=mp_context)
+
+
+def _init_dataset_worker(dataset):
+    """Stores the dataset in the worker process, see map_dataset_folders"""
+    global _WORKER_DATASET
+    _WORKER_DATASET = dataset
+
+
+def _call_worker_dataset(method, folder):
+    """Calls the method of the dataset stored in the worker process"""
+    return getattr(_WORKER_DATASET, method)(folder)
+
+
+def process_map_unordered(func: Callable,
+                          items: Iterable,
+                          max_workers: int,
+                          initializer: Optional[Callable] = None,
+                          initargs: tuple = (),
+                          mp_context=None) -> Iterator:
+    """
+    Applies func to each item in a pool of worker processes, and yields the
+    results as soon as they are complete, in arbitrary order. Only a bounded
+    number of items are submitted at a time, so that the items are consumed
+    lazily, e.g. while the folder tree is still being walked, and a slow
+    item doesn't hold back the results of the others.
+
+    The log records of the workers are sent to the main process, and
+    written by its handlers, so that the workers never open the log files
+    themselves.
+
+    Parameters
+    ----------
+    func : Callable
+        picklable function called with each item in the worker processes
+    items : Iterable
+        items to be processed
+    max_workers : int
+        number of worker processes
+    initializer : Callable
+        called once in each worker process, with initargs
+    initargs : tuple
+        arguments passed to the initializer
+    mp_context : multiprocessing.context.BaseContext
+        context used to start the worker processes, e.g.
+        multiprocessing.get_context('spawn'). Default is None, i.e. the
+        default context of the platform.
+
+    Yields
+    ------
+    result of func for each item
+    """
+    if mp_context is None:
+        mp_context = multiprocessing.get_context()
+    log_queue = mp_context.Queue()
+    listener = QueueListener(log_queue, *logger.handlers,
+                             respect_handler_level=True)
+    listener.start()
+
+    max_pending = 4 * max_workers
+    pending = set()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=mp_context,
+                                 initializer=_init_worker_process,
+                                 initargs=(log_queue, initializer,
+                                           initargs)) as executor:
+            for item in items:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(func, item))
+            for future in as_completed(pending):
+                yield future.result()
+    finally:
+        # the workers have exited by now, so all their records are queued
+        listener.stop()
+
+
+def _init_worker_process(log_queue, initializer, initargs):
+    """
+    Sends the log records of a worker process to the main process, see
+    process_map_unordered, and then runs the initializer
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _name_matcher(pattern: str) -> Callable[[str], bool]:
+    """
+    Returns a function to match file names against the pattern. Patterns
+    like '*.dcm' are matched with a simple suffix check instead of fnmatch,
+    as the names of all the files in the dataset are matched.
+    """
+    suffix = pattern[1:]
+    if pattern.startswith('*') and not any(c in suffix for c in '*?['):
+        def matches(name):
+            return name.endswith(suffix)
+    else:
+        def matches(name):
+            return fnmatch(name, pattern)
+    return matches
+
+
+def files_in_folder(folder: Union[Path, str],
+                    pattern: str = '*') -> List[str]:
+    """
+    Lists the files in a folder matching the pattern, using os.scandir.
+    The paths are returned as sorted strings, which is cheaper than globbing
+    and sorting Path objects.
+
+    Parameters
+    ----------
+    folder : Path | str
+        path to the folder
+    pattern : str
+        pattern to filter files. Default is '*'.
+
+    Returns
+    -------
+    files : List[str]
+        sorted list of paths to the matching files
+    """
+    matches = _name_matcher(pattern)
+    with os.scandir(folder) as entries:
+        files = [entry.path for entry in entries
+                 if matches(entry.name) and not entry.is_dir()]
+    files.sort()
+    return files
+
+
 def is_folder_with_no_subfolders(fpath):
     """
     Check if the folder has any subfolders
@@ -86,7 +468,10 @@ def is_folder_with_no_subfolders(fpath):
     if not fpath.is_dir():
         raise FileNotFoundError(f'Folder not found: {fpath}')
 
-    sub_dirs = [file_ for file_ in fpath.iterdir() if file_.is_dir()]
+    # DirEntry.is_dir uses the file type from the directory listing, and
+    #   doesn't need another stat call per entry
+    with os.scandir(fpath) as entries:
+        sub_dirs = [Path(entry.path) for entry in entries if entry.is_dir()]
 
     return len(sub_dirs) < 1, sub_dirs
 